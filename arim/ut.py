@@ -5,8 +5,10 @@ Toolbox of functions for ultrasonic testing/acoustics.
 # This module must be kept free of any arim dependencies because so that it could be used
 # without arim.
 
+import functools
 import warnings
 
+import numba
 import numpy as np
 
 
@@ -14,11 +16,17 @@ class UtWarning(UserWarning):
     pass
 
 
-def fmc(numelements):
+def fmc(numelements, readonly=False):
     """
     Return all pairs of elements for a FMC.
     HMC as performed by Brain.
 
+    Parameters
+    ----------
+    numelements : int
+    readonly : bool
+        If True, return cached read-only arrays instead of new arrays. Default: False.
+
     Returns
     -------
     tx : ndarray [numelements^2]
@@ -26,46 +34,89 @@ def fmc(numelements):
     rx : ndarray
         Receiver for each timetrace: 1, 2, ..., 1, 2, ...
     """
-    numelements = int(numelements)
+    tx, rx = _fmc(int(numelements))
+    if not readonly:
+        tx, rx = tx.copy(), rx.copy()
+    return tx, rx
+
+
+@functools.lru_cache(maxsize=32)
+def _fmc(numelements):
     elements = np.arange(numelements)
+    shape = (numelements, numelements)
 
+    # Each array is materialised once, when the broadcast view is flattened.
     # 0 0 0    1 1 1    2 2 2
-    tx = np.repeat(elements, numelements)
+    tx = np.broadcast_to(elements[:, np.newaxis], shape).reshape(-1)
 
     # 0 1 2    0 1 2    0 1 2
-    rx = np.tile(elements, numelements)
+    rx = np.broadcast_to(elements[np.newaxis, :], shape).reshape(-1)
+
+    # Cached arrays are shared between the callers
+    tx.flags.writeable = False
+    rx.flags.writeable = False
     return tx, rx
 
 
-def hmc(numelements):
+def hmc(numelements, readonly=False):
     """
     Return all pairs of elements for a HMC.
     HMC as performed by Brain (rx >= tx)
 
+    Parameters
+    ----------
+    numelements : int
+    readonly : bool
+        If True, return cached read-only arrays instead of new arrays. Default: False.
+
     Returns
     -------
-    tx : ndarray [numelements^2]
+    tx : ndarray [numelements * (numelements + 1) / 2]
         Transmitter for each timetrace: 0, 0, 0, ..., 1, 1, 1, ...
     rx : ndarray
         Receiver for each timetrace: 0, 1, 2, ..., 1, 2, ...
     """
-    numelements = int(numelements)
-    elements = np.arange(numelements)
+    tx, rx = _hmc(int(numelements))
+    if not readonly:
+        tx, rx = tx.copy(), rx.copy()
+    return tx, rx
+
 
+@functools.lru_cache(maxsize=32)
+def _hmc(numelements):
     # 0 0 0    1 1    2
-    tx = np.repeat(elements, range(numelements, 0, -1))
-
-    # 0 1 2    0 1    2
-    rx = np.zeros_like(tx)
-    take_n_last = np.arange(numelements, 0, -1)
-    start = 0
-    for n in take_n_last:
-        stop = start + n
-        rx[start:stop] = elements[-n:]
-        start = stop
+    # 0 1 2    1 2    2
+    tx, rx = np.triu_indices(numelements)
+
+    # Cached arrays are shared between the callers
+    tx.flags.writeable = False
+    rx.flags.writeable = False
     return tx, rx
 
 
+def _pack_pairs(tx, rx, numelements):
+    """
+    Encode each pair of elements (tx[i], rx[i]) as the integer
+    ``tx[i] * numelements + rx[i]``.
+
+    Two pairs are equal if and only if their keys are equal, provided that the
+    indices are between 0 and numelements-1.
+
+    Parameters
+    ----------
+    tx : ndarray
+    rx : ndarray
+    numelements : int
+
+    Returns
+    -------
+    keys : ndarray of int64
+    """
+    tx = np.asarray(tx).astype(np.int64, copy=False)
+    rx = np.asarray(rx).astype(np.int64, copy=False)
+    return tx * numelements + rx
+
+
 def infer_capture_method(tx, rx):
     """
     Infers the capture method from the indices of transmitters and receivers.
@@ -83,28 +134,31 @@ def infer_capture_method(tx, rx):
     -------
     capture_method : string
     """
-    numelements = max(np.max(tx), np.max(rx)) + 1
+    tx = np.asarray(tx)
+    rx = np.asarray(rx)
+    numelements = int(max(np.max(tx), np.max(rx))) + 1
     assert len(tx) == len(rx)
+    if min(np.min(tx), np.min(rx)) < 0:
+        return "unsupported"
 
-    # Get the unique combinations tx/rx of the input.
-    # By using set, we ignore the order of the combinations tx/rx.
-    combinations = set(zip(tx, rx))
+    def sorted_keys(tx, rx):
+        # By sorting, we ignore the order of the combinations tx/rx.
+        return np.sort(_pack_pairs(tx, rx, numelements))
+
+    keys = sorted_keys(tx, rx)
 
     # Could it be a HMC? Most frequent case, go first.
     # Remark: HMC can be made with tx >= rx or tx <= rx. Check both.
-    tx_hmc, rx_hmc = hmc(numelements)
-    combinations_hmc1 = set(zip(tx_hmc, rx_hmc))
-    combinations_hmc2 = set(zip(rx_hmc, tx_hmc))
-
+    tx_hmc, rx_hmc = hmc(numelements, readonly=True)
     if (len(tx_hmc) == len(tx)) and (
-        (combinations == combinations_hmc1) or (combinations == combinations_hmc2)
+        np.array_equal(keys, sorted_keys(tx_hmc, rx_hmc))
+        or np.array_equal(keys, sorted_keys(rx_hmc, tx_hmc))
     ):
         return "hmc"
 
     # Could it be a FMC?
-    tx_fmc, rx_fmc = fmc(numelements)
-    combinations_fmc = set(zip(tx_fmc, rx_fmc))
-    if (len(tx_fmc) == len(tx)) and (combinations == combinations_fmc):
+    tx_fmc, rx_fmc = fmc(numelements, readonly=True)
+    if (len(tx_fmc) == len(tx)) and np.array_equal(keys, sorted_keys(tx_fmc, rx_fmc)):
         return "fmc"
 
     # At this point we are hopeless
@@ -139,19 +193,25 @@ def default_timetrace_weights(tx, rx):
     timetrace_weights : ndarray
 
     """
+    tx = np.asarray(tx)
+    rx = np.asarray(rx)
     if len(tx) != len(rx):
         raise ValueError("tx and rx must have the same lengths (numtimetraces)")
     numtimetraces = len(tx)
-
-    # elements_pairs contains (tx[0], rx[0]), (tx[1], rx[1]), etc.
-    elements_pairs = {*zip(tx, rx)}
-    timetrace_weights = np.ones(numtimetraces)
-    for this_tx, this_rx, timetrace_weight in zip(
-        tx, rx, np.nditer(timetrace_weights, op_flags=["readwrite"])
-    ):
-        if (this_rx, this_tx) not in elements_pairs:
-            timetrace_weight[...] = 2.0
-    return timetrace_weights
+    if numtimetraces == 0:
+        return np.ones(0)
+    if min(tx.min(), rx.min()) < 0:
+        raise ValueError("tx and rx must be non-negative")
+
+    # Look for the pair (rx[i], tx[i]) in the sorted keys of the pairs (tx, rx).
+    numelements = int(max(tx.max(), rx.max())) + 1
+    sorted_keys = np.sort(_pack_pairs(tx, rx, numelements))
+    swapped_keys = _pack_pairs(rx, tx, numelements)
+    idx = np.searchsorted(sorted_keys, swapped_keys)
+    has_reciprocal = (idx < numtimetraces) & (
+        sorted_keys[np.minimum(idx, numtimetraces - 1)] == swapped_keys
+    )
+    return np.where(has_reciprocal, 1.0, 2.0)
 
 
 def default_scanline_weights(tx, rx):
@@ -163,7 +223,22 @@ def default_scanline_weights(tx, rx):
     return default_timetrace_weights(tx, rx)
 
 
-def decibel(arr, reference=None, neginf_value=-1000.0, return_reference=False):
+def _get_array_module(arr):
+    """
+    Return the module (numpy or cupy) to use for the array.
+
+    CuPy is an optional dependency, imported only if a CuPy array is given.
+    """
+    if type(arr).__module__.startswith("cupy"):
+        import cupy
+
+        return cupy.get_array_module(arr)
+    return np
+
+
+def decibel(
+    arr, reference=None, neginf_value=-1000.0, return_reference=False, dtype=None
+):
     """
     Return 20*log10(abs(arr) / reference)
 
@@ -174,7 +249,7 @@ def decibel(arr, reference=None, neginf_value=-1000.0, return_reference=False):
     Parameters
     ----------
     arr : ndarray
-        Values to convert in dB.
+        Values to convert in dB. CuPy arrays are processed on the GPU.
     reference : float or None
         Reference value for 0 dB. Default: None
     neginf_value : float or None
@@ -182,6 +257,11 @@ def decibel(arr, reference=None, neginf_value=-1000.0, return_reference=False):
         dB values are not changed.
     return_max : bool
         Default: False.
+    dtype : numpy.dtype or None
+        Floating point type used for the computation and the output. Use
+        ``numpy.float32`` to halve the memory traffic on large arrays (about 7
+        significant digits). If None, keep the precision of ``arr`` (float64 for
+        integers). Default: None
 
     Returns
     -------
@@ -191,25 +271,48 @@ def decibel(arr, reference=None, neginf_value=-1000.0, return_reference=False):
         Return ``max(abs(arr))``. This value is returned only if return_max is true.
 
     """
-    # Disable warnings messages for log10(0.0)
-    arr_abs = np.abs(arr)
+    xp = _get_array_module(arr)
+    arr = xp.asanyarray(arr)
 
-    if arr_abs.shape == ():
+    # All computations are done in-place in the buffer allocated here.
+    # Remark: abs of complex numbers neither overflows nor underflows.
+    if dtype is None:
+        arr_db = xp.abs(arr)
+    else:
+        # abs cannot cast complex inputs to a given float type with 'dtype':
+        # write its result directly in the output buffer.
+        arr_db = xp.empty_like(arr, dtype=dtype)
+        xp.abs(arr, out=arr_db, casting="same_kind")
+    if arr_db.dtype.kind != "f":
+        arr_db = arr_db.astype(np.float64)
+
+    if arr_db.shape == ():
         orig_shape = ()
-        arr_abs = arr_abs.reshape((1,))
+        arr_db = arr_db.reshape((1,))
     else:
         orig_shape = None
 
     if reference is None:
-        reference = np.nanmax(arr_abs)
+        reference = xp.nanmax(arr_db)
     else:
         assert reference > 0.0
 
+    if isinstance(arr_db, np.ma.MaskedArray):
+        # In-place ufuncs would mask every value: work on the data, the mask
+        # of arr_db is unchanged.
+        arr_db_data = arr_db.data
+    else:
+        arr_db_data = arr_db
+    arr_db_data /= reference
+    if neginf_value is not None:
+        # Locate log10(0.0) beforehand instead of searching -inf afterwards.
+        # Remark: CuPy ufuncs do not support the argument 'where'.
+        is_zero = arr_db_data == 0.0
     with np.errstate(divide="ignore"):
-        arr_db = 20 * np.log10(arr_abs / reference)
-
+        xp.log10(arr_db_data, out=arr_db_data)
+    arr_db_data *= 20
     if neginf_value is not None:
-        arr_db[np.isneginf(arr_db)] = neginf_value
+        arr_db_data[is_zero] = neginf_value
 
     if orig_shape is not None:
         arr_db = arr_db.reshape(orig_shape)
@@ -225,19 +328,28 @@ def wrap_phase(phases):
 
     http://stackoverflow.com/questions/15927755/opposite-of-numpy-unwrap
     """
-    phases = np.asarray(phases)
-    return (phases + np.pi) % (2 * np.pi) - np.pi
+    return _wrap_phase(phases)
+
+
+@numba.vectorize(["float32(float32)", "float64(float64)"], nopython=True, cache=True)
+def _wrap_phase(phase):
+    # Single pass, no temporary array
+    return (phase + np.pi) % (2 * np.pi) - np.pi
 
 
-def instantaneous_phase_shift(analytic_sig, time_vect, carrier_frequency):
+def instantaneous_phase_shift(analytic_sig, time_vect, carrier_frequency, dtype=None):
     """
-    For a signal $x(ray) = A * exp(i (2 pi f_0 ray + phi(ray)))$, returns phi(ray) in [-pi, pi[.
+    For a signal $x(ray) = A * exp(i (2 pi f_0 ray + phi(ray)))$, returns phi(ray) in ]-pi, pi].
 
     Parameters
     ----------
     analytic_sig: ndarray
     time_vect: ndarray
-    carrier_frequency: float
+    carrier_frequency: float or ndarray
+    dtype : numpy.dtype or None
+        Floating point type used for the computation and the output: ``numpy.float64``
+        or ``numpy.float32``. float32 halves the memory traffic; the carrier phase
+        is computed in float64 in both cases. If None, use float64. Default: None
 
     Returns
     -------
@@ -245,17 +357,42 @@ def instantaneous_phase_shift(analytic_sig, time_vect, carrier_frequency):
 
     """
     analytic_sig = np.asarray(analytic_sig)
-    dtype = analytic_sig.dtype
-    if dtype.kind != "c":
+    if analytic_sig.dtype.kind != "c":
         warnings.warn(
             "Expected an analytic (complex) signal, got {}. Use a Hilbert "
-            "transform to get the analytic signal.".format(dtype),
+            "transform to get the analytic signal.".format(analytic_sig.dtype),
             UtWarning,
             stacklevel=2,
         )
+    dtype = np.dtype(np.float64 if dtype is None else dtype)
+    complex_dtype = np.result_type(dtype, np.complex64)
+    # Remove the carrier before taking the angle: the phase is then wrapped by
+    # atan2, without subtracting a large phase ramp. The carrier is computed once
+    # per time sample, not once per output element.
     phase_correction = 2 * np.pi * carrier_frequency * time_vect
-    phase = wrap_phase(np.angle(analytic_sig) - phase_correction)
-    return phase
+    cos_correction = np.cos(phase_correction).astype(dtype, copy=False)
+    sin_correction = np.sin(phase_correction).astype(dtype, copy=False)
+    return _instantaneous_phase_shift(
+        analytic_sig,
+        cos_correction,
+        sin_correction,
+        signature=(complex_dtype, dtype, dtype, dtype),
+    )
+
+
+@numba.vectorize(
+    [
+        "float32(complex64, float32, float32)",
+        "float64(complex128, float64, float64)",
+    ],
+    nopython=True,
+    cache=True,
+)
+def _instantaneous_phase_shift(analytic_sig, cos_correction, sin_correction):
+    # angle(analytic_sig * exp(-i phase_correction)), without temporary array
+    real = analytic_sig.real * cos_correction + analytic_sig.imag * sin_correction
+    imag = analytic_sig.imag * cos_correction - analytic_sig.real * sin_correction
+    return np.arctan2(imag, real)
 
 
 def make_timevect(num, step, start=0.0, dtype=None):
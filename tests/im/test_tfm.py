@@ -9,6 +9,16 @@ import arim.io
 import arim.geometry as g
 
 
+def make_reciprocal_timetraces(tx_arr, rx_arr, numsamples):
+    """Random timetraces, where the timetraces (tx, rx) and (rx, tx) are equal"""
+    seeds = (tx_arr * rx_arr) ** 2  # symmetric in tx and rx
+    unique_seeds, seed_idx = np.unique(seeds, return_inverse=True)
+    unique_timetraces = np.array(
+        [np.random.RandomState(seed).rand(numsamples) for seed in unique_seeds]
+    )
+    return np.take(unique_timetraces, seed_idx, axis=0)
+
+
 def test_extrema_lookup_times_in_rectbox():
     grid = g.Grid(-10.0, 10.0, 0.0, 0.0, 0.0, 15.0, 1.0)
     tx = [0, 0, 0, 1, 1, 1]
@@ -56,10 +66,7 @@ def test_multiview_tfm(use_real_grid):
     tx_arr, rx_arr = arim.ut.fmc(probe.numelements)
     time = arim.Time(0.5e-6, 1 / 20e6, 100)
     # use random data but ensure reciprocity
-    timetraces = np.zeros((len(tx_arr), len(time)))
-    for i, (tx, rx) in enumerate(zip(tx_arr, rx_arr)):
-        np.random.seed((tx * rx) ** 2)  # symmetric in tx and rx
-        timetraces[i] = np.random.rand(len(time))
+    timetraces = make_reciprocal_timetraces(tx_arr, rx_arr, len(time))
     block = arim.Material(6300, 3100)
     frame = arim.Frame(
         timetraces, time, tx_arr, rx_arr, probe, arim.ExaminationObject(block)
@@ -126,10 +133,7 @@ def test_contact_tfm(use_hmc):
     time = arim.Time(0.5e-6, 1 / 20e6, 100)
 
     # use random data but ensure reciprocity
-    timetraces = np.zeros((len(tx_arr), len(time)))
-    for i, (tx, rx) in enumerate(zip(tx_arr, rx_arr)):
-        np.random.seed((tx * rx) ** 2)  # symmetric in tx and rx
-        timetraces[i] = np.random.rand(len(time))
+    timetraces = make_reciprocal_timetraces(tx_arr, rx_arr, len(time))
 
     # check reciprocity
     if not use_hmc:
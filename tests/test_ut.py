@@ -42,6 +42,65 @@ def test_decibel():
     assert np.isneginf(db[0])
     assert np.allclose(db[1:-1], [-60.0, -40.0, -20.0, 0.0])
 
+    # Complex input
+    arr = np.array([0.0, 0.01j, 0.06 + 0.08j, 1.0, -10.0j])
+    db, ref = ut.decibel(arr, return_reference=True)
+    assert np.allclose(db, [-1000.0, -60.0, -40.0, -20.0, 0.0])
+    assert np.isclose(ref, 10.0)
+    db = ut.decibel(arr, reference=1.0)
+    assert np.allclose(db, [-1000.0, -40.0, -20.0, 0.0, 20.0])
+
+    # Complex input with very large and very small magnitudes
+    db, ref = ut.decibel(np.complex64([1e20, 1.0]), return_reference=True)
+    assert db.dtype == np.float32
+    assert np.allclose(db, [0.0, -400.0])
+    assert np.isclose(ref, 1e20)
+    db = ut.decibel(np.complex64([1e-25, 1.0]))
+    assert np.allclose(db, [-500.0, 0.0])
+    db = ut.decibel(np.complex64([1e-25, 1e-26]), reference=np.float32(1e-25))
+    assert np.allclose(db, [0.0, -20.0])
+    db = ut.decibel(np.complex64([1e20, 1e19]), reference=np.float32(1e20))
+    assert np.allclose(db, [0.0, -20.0])
+    db = ut.decibel(np.array([1e-200 + 0j, 1.0]))
+    assert np.allclose(db, [-4000.0, 0.0])
+    db = ut.decibel(np.array([1e200j, 1.0]))
+    assert np.allclose(db, [0.0, -4000.0])
+    db = ut.decibel(np.array([1e20 + 0j, 1.0]), dtype=np.float32)
+    assert db.dtype == np.float32
+    assert np.allclose(db, [0.0, -400.0])
+
+    # Masked input
+    arr = np.ma.array([1.0, 2.0, 0.1], mask=[False, True, False])
+    db = ut.decibel(arr)
+    assert isinstance(db, np.ma.MaskedArray)
+    assert np.all(db.mask == [False, True, False])
+    assert np.allclose(db.compressed(), [0.0, -20.0])
+
+    # Computation in float32
+    arr = np.array([0.0, 0.01, 0.1, 1.0, 10.0])
+    for arr_ in (arr, arr * 1j, (arr * 100).astype(int)):
+        db = ut.decibel(arr_, dtype=np.float32)
+        assert db.dtype == np.float32
+        assert np.allclose(db, [-1000.0, -60.0, -40.0, -20.0, 0.0])
+
+    # Integer input; the input is not modified
+    arr = np.array([0, -1, 10])
+    db = ut.decibel(arr)
+    assert np.allclose(db, [-1000.0, -20.0, 0.0])
+    np.testing.assert_array_equal(arr, [0, -1, 10])
+
+
+def test_decibel_cupy():
+    cupy = pytest.importorskip("cupy")
+    arr = np.array([0.0, 0.01, 0.1, 1.0, 10.0])
+    for arr_ in (arr, (arr * 1j).astype(np.complex64), arr * 1j):
+        db, ref = ut.decibel(cupy.asarray(arr_), return_reference=True)
+        assert isinstance(db, cupy.ndarray)
+        db_ref, ref_ref = ut.decibel(arr_, return_reference=True)
+        assert db.dtype == db_ref.dtype
+        np.testing.assert_allclose(cupy.asnumpy(db), db_ref, rtol=1e-6)
+        assert np.isclose(float(ref), ref_ref)
+
 
 def test_fmc():
     numelements = 3
@@ -57,6 +116,18 @@ def test_fmc():
     assert np.all(tx == tx2)
     assert np.all(rx == rx2)
 
+    # Default arrays can be modified without altering the next results
+    tx[0] = 666
+    tx, rx = ut.fmc(numelements)
+    assert np.all(tx == tx2)
+
+    tx_ro, rx_ro = ut.fmc(numelements, readonly=True)
+    assert not tx_ro.flags.writeable
+    assert not rx_ro.flags.writeable
+    assert np.all(tx_ro == tx2)
+    assert np.all(rx_ro == rx2)
+    assert ut.fmc(numelements, readonly=True)[0] is tx_ro
+
 
 def test_hmc():
     numelements = 3
@@ -72,6 +143,20 @@ def test_hmc():
     assert np.all(tx == tx2)
     assert np.all(rx == rx2)
 
+    tx_ro, rx_ro = ut.hmc(numelements, readonly=True)
+    assert not tx_ro.flags.writeable
+    assert np.all(tx_ro == tx2)
+    assert np.all(rx_ro == rx2)
+    assert tx.flags.writeable
+
+    # Same ordering as the FMC with the timetraces rx < tx removed
+    numelements = 16
+    tx, rx = ut.hmc(numelements)
+    tx_fmc, rx_fmc = ut.fmc(numelements)
+    keep = rx_fmc >= tx_fmc
+    np.testing.assert_array_equal(tx, tx_fmc[keep])
+    np.testing.assert_array_equal(rx, rx_fmc[keep])
+
 
 def test_infer_capture_method():
     # Valid HMC
@@ -157,6 +242,19 @@ def test_default_timetrace_weights():
     expected[tx != rx] = 2.0
     np.testing.assert_almost_equal(ut.default_timetrace_weights(tx, rx), expected)
 
+    # Shuffled HMC
+    perm = np.random.RandomState(123).permutation(len(tx))
+    np.testing.assert_almost_equal(
+        ut.default_timetrace_weights(tx[perm], rx[perm]), expected[perm]
+    )
+
+    # No timetrace
+    assert ut.default_timetrace_weights([], []).shape == (0,)
+
+    # Negative indices
+    with pytest.raises(ValueError):
+        ut.default_timetrace_weights([-1, 0], [0, 0])
+
 
 def test_instantaneous_phase_shift():
     t = np.arange(300)
@@ -170,6 +268,35 @@ def test_instantaneous_phase_shift():
     with pytest.warns(ut.UtWarning):
         theta_computed = ut.instantaneous_phase_shift(sig.real, t, f0)
 
+    # One timetrace per row, time vector broadcast along the last axis
+    thetas = np.array([[np.pi / 3], [-np.pi / 4], [2.0]])
+    sigs = 12.0 * np.exp(1j * (2.0 * np.pi * f0 * t + thetas))
+    theta_computed = ut.instantaneous_phase_shift(sigs, t, f0)
+    assert theta_computed.shape == sigs.shape
+    np.testing.assert_allclose(theta_computed, np.broadcast_to(thetas, sigs.shape))
+
+    # One carrier frequency per row
+    f0s = np.array([[f0], [2 * f0], [3 * f0]])
+    sigs = 12.0 * np.exp(1j * (2.0 * np.pi * f0s * t + thetas))
+    theta_computed = ut.instantaneous_phase_shift(sigs, t, f0s)
+    np.testing.assert_allclose(theta_computed, np.broadcast_to(thetas, sigs.shape))
+
+    # Computation in float32
+    t = np.arange(300) * 1e-8
+    f0 = 5e6
+    sig = 12.0 * np.exp(1j * (2.0 * np.pi * f0 * t + theta))
+    theta_computed = ut.instantaneous_phase_shift(sig, t, f0, dtype=np.float32)
+    assert theta_computed.dtype == np.float32
+    np.testing.assert_allclose(theta_computed, theta, rtol=1e-4)
+
+    sigs = 12.0 * np.exp(1j * (2.0 * np.pi * f0 * t + thetas))
+    theta_computed = ut.instantaneous_phase_shift(sigs, t, f0, dtype=np.float32)
+    assert theta_computed.dtype == np.float32
+    assert theta_computed.shape == sigs.shape
+    np.testing.assert_allclose(
+        theta_computed, np.broadcast_to(thetas, sigs.shape), rtol=1e-4
+    )
+
 
 def test_wrap_phase():
     res_phases = [
@@ -183,6 +310,11 @@ def test_wrap_phase():
     unwrapped, wrapped = zip(*res_phases)
     np.testing.assert_allclose(ut.wrap_phase(unwrapped), wrapped)
 
+    # float32 is preserved (-pi and pi are not exactly representable, skip them)
+    wrapped_32 = ut.wrap_phase(np.asarray(unwrapped[2:], np.float32))
+    assert wrapped_32.dtype == np.float32
+    np.testing.assert_allclose(wrapped_32, wrapped[2:], rtol=1e-6)
+
 
 def test_make_timevect():
     # loop over different values to check numerical robustness
@@ -213,6 +345,20 @@ def test_make_timevect():
         np.testing.assert_allclose(x[-1], end)
         assert x.dtype == dtype
 
+    # Integer output
+    x = ut.make_timevect(10, 1.0, dtype=int)
+    np.testing.assert_array_equal(x, np.arange(10))
+
+    # float32 output: computed in float64 then correctly rounded once
+    num = 100000
+    start = 300e-6
+    step = 50e-9
+    x = ut.make_timevect(num, step, start, dtype=np.float32)
+    assert x.dtype == np.float32
+    np.testing.assert_array_equal(
+        x, ut.make_timevect(num, step, start).astype(np.float32)
+    )
+
 
 def test_filter_unique_views():
     unique_views = arim.ut.filter_unique_views(